@@ -1,12 +1,26 @@
 import os
+import sys
 import openai
 from colorama import init, Fore, Style
 import re
 import json
-from typing import Dict, List, Optional, Tuple
+import time
+import queue
+import argparse
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
 from autogen import AssistantAgent, UserProxyAgent, GroupChat, GroupChatManager
+from autogen.token_count_utils import count_token
 from pathlib import Path
 
+# inotify只在Linux上可用；其他系统上inotify_simple可以导入，但创建INotify时会出错
+INotify = None
+if sys.platform.startswith("linux"):
+    try:
+        from inotify_simple import INotify, flags as inotify_flags
+    except ImportError:  # 未安装inotify_simple时使用轮询
+        INotify = None
+
 # 初始化colorama
 init()
 
@@ -48,6 +62,24 @@ OPENAI_CONFIG = {
     "cache_seed": None
 }
 
+# 上下文预算配置
+CONTEXT_CONFIG = {
+    "max_request_tokens": 3000,  # 单次请求的token上限，包括系统提示词、消息和为回复预留的空间
+    "min_content_tokens": 500,  # 系统提示词过长时，消息内容至少保留的token数
+    "integration_group_size": 4,  # 分层集成时每组最多合并的代码片段数，大文件按此切分代码块
+    "batch_snippets": True,  # 是否将多个小代码片段打包到一次请求中处理
+    "batch_max_snippets": 10  # 每次批量请求最多包含的代码片段数
+}
+
+# 监听模式配置
+WATCH_CONFIG = {
+    "debounce_seconds": 0.5,  # 连续保存合并为一次转换的静默时间
+    "poll_interval": 1.0  # 无法使用inotify时的轮询间隔
+}
+
+# 处理失败的代码片段以此标记开头，原始代码以注释形式保留
+FAILED_SNIPPET_MARK = "# [处理失败]"
+
 # 检查API密钥
 if not OPENAI_CONFIG["config_list"][0]["api_key"]:
     print_colored("错误：未设置OpenAI API密钥", COLOR_ERROR)
@@ -60,8 +92,364 @@ print_colored(f"- 密钥长度: {len(OPENAI_CONFIG['config_list'][0]['api_key'])
 print_colored(f"- 密钥前缀: {OPENAI_CONFIG['config_list'][0]['api_key'][:10]}", COLOR_USER)
 print_colored(f"- 密钥后缀: {OPENAI_CONFIG['config_list'][0]['api_key'][-10:]}", COLOR_USER)
 
+def count_tokens(text: str) -> int:
+    """统计文本在当前模型下的token数"""
+    return count_token(text, model=OPENAI_CONFIG["config_list"][0]["model"])
+
+def pack_by_budget(items: List[str], budget: int, max_items: Optional[int] = None, base_tokens: int = 0) -> List[List[str]]:
+    """按token预算将文本依次装箱，单个超出预算的文本单独成组"""
+    groups = []
+    current = []
+    current_tokens = base_tokens
+    for item in items:
+        item_tokens = count_tokens(item) + 2  # 预留分隔空行
+        if current and (current_tokens + item_tokens > budget or (max_items and len(current) >= max_items)):
+            groups.append(current)
+            current = []
+            current_tokens = base_tokens
+        current.append(item)
+        current_tokens += item_tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def format_snippet_batch(items: List[Tuple[str, str]]) -> str:
+    """将带编号的代码片段拼接为批量请求内容"""
+    return "\n\n".join(f"<<<片段 {snippet_id}>>>\n{content}\n<<<结束 {snippet_id}>>>" for snippet_id, content in items)
+
+def parse_snippet_batch(reply: str) -> Dict[str, str]:
+    """从批量请求的回复中按编号拆分出各代码片段的结果"""
+    pattern = r"<<<片段 (S\d+)>>>[ \t]*\n(.*?)\n[ \t]*<<<结束 \1>>>"
+    return {snippet_id: content.strip() for snippet_id, content in re.findall(pattern, reply, re.DOTALL)}
+
+def _scan_braces(line: str, state: str) -> Tuple[int, bool, str]:
+    """统计一行代码中的花括号深度变化，跳过注释、字符串和字符常量"""
+    delta = 0
+    opened = False
+    i = 0
+    while i < len(line):
+        ch = line[i]
+        pair = line[i:i + 2]
+        if state == "block_comment":
+            if pair == "*/":
+                state = "code"
+                i += 1
+        elif state in ('"', "'"):
+            if ch == "\\":
+                i += 1
+            elif ch == state:
+                state = "code"
+        elif pair == "//":
+            break
+        elif pair == "/*":
+            state = "block_comment"
+            i += 1
+        elif ch in ('"', "'"):
+            state = ch
+        elif ch == "{":
+            delta += 1
+            opened = True
+        elif ch == "}":
+            delta -= 1
+        i += 1
+    # 字符串和字符常量不跨行
+    if state in ('"', "'"):
+        state = "code"
+    return delta, opened, state
+
+# 提取全局变量引用时忽略的CAPL关键字和类型名
+CAPL_KEYWORDS = {
+    "int", "long", "int64", "dword", "qword", "word", "byte", "char", "float", "double", "void",
+    "const", "static", "unsigned", "signed", "struct", "enum", "message", "msTimer", "timer",
+    "signal", "sysvar", "diagRequest", "diagResponse", "linFrame", "frFrame", "this"
+}
+
+def _identifiers(code: str) -> Set[str]:
+    """提取代码中的标识符，跳过注释、字符串、字符常量和CAPL关键字"""
+    code = re.sub(r"//.*|/\*.*?\*/|\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'", " ", code, flags=re.DOTALL)
+    return set(re.findall(r"[A-Za-z_]\w*", code)) - CAPL_KEYWORDS
+
+def _split_declarations(body: str) -> List[str]:
+    """将variables块内容按语句拆分为全局声明列表，保持原始格式"""
+    declarations = []
+    current = []
+    depth = 0
+    state = "code"
+    for line in body.splitlines():
+        if not current and not line.strip():
+            continue
+        current.append(line)
+        delta, _, state = _scan_braces(line, state)
+        depth = max(depth + delta, 0)
+        code = re.sub(r"//.*", "", line).strip()
+        if depth == 0 and state == "code" and code.endswith(";"):
+            declarations.append("\n".join(current))
+            current = []
+    if current and "\n".join(current).strip():
+        declarations.append("\n".join(current))
+    return declarations
+
+def split_capl_units(capl_code: str) -> Tuple[str, List[str], List[str]]:
+    """按顶层花括号块将CAPL代码拆分为预处理部分（预处理指令、includes块）、全局声明列表和函数单元列表"""
+    preamble_lines = []
+    declarations = []
+    units = []
+    current = []
+    depth = 0
+    opened = False
+    state = "code"
+    for line in capl_code.splitlines():
+        stripped = line.strip()
+        if depth == 0 and not opened and state == "code" and stripped.startswith("#"):
+            preamble_lines.append(line)
+            continue
+        current.append(line)
+        delta, line_opened, state = _scan_braces(line, state)
+        opened = opened or line_opened
+        depth = max(depth + delta, 0)
+        if depth > 0 or state != "code":
+            continue
+        text = "\n".join(current)
+        if opened:
+            head = text.split("{", 1)[0]
+            head = re.sub(r"//.*|/\*.*?\*/", "", head, flags=re.DOTALL).strip().lower()
+            if head == "includes":
+                preamble_lines.extend(current)
+            elif head == "variables":
+                declarations.extend(_split_declarations(text[text.index("{") + 1:text.rindex("}")]))
+            else:
+                units.append(text)
+            current = []
+            opened = False
+        elif stripped.endswith(";"):
+            # 块外的全局声明与variables块中的声明一起处理
+            declarations.append(text)
+            current = []
+    # 未闭合的尾部内容归入最后一个单元
+    if current and "\n".join(current).strip():
+        if units:
+            units[-1] += "\n" + "\n".join(current)
+        else:
+            units.append("\n".join(current))
+    return "\n".join(preamble_lines).strip(), declarations, units
+
+def _needed_declarations(names: Set[str], declaration_ids: List[Set[str]], selected: Set[int]) -> Set[int]:
+    """查找引用到的全局声明，包括被选中声明间接引用的声明（如结构体类型）"""
+    names = set(names)
+    selected = set(selected)
+    changed = True
+    while changed:
+        changed = False
+        for i, ids in enumerate(declaration_ids):
+            if i not in selected and ids & names:
+                selected.add(i)
+                names |= ids
+                changed = True
+    return selected
+
+def split_capl_code(capl_code: str, budget: int) -> List[str]:
+    """按函数边界将CAPL代码切分为不超过token预算的代码块，每块只附带预处理部分和自身用到的全局变量"""
+    preamble, declarations, units = split_capl_units(capl_code)
+    if not units:
+        return [capl_code]
+    preamble_tokens = count_tokens(preamble) + 2 if preamble else 0
+    if preamble_tokens > budget:
+        print_colored(f"警告：预处理部分约{preamble_tokens} tokens，单独已超出上下文预算（{budget} tokens）", COLOR_ERROR)
+    wrapper_tokens = count_tokens("variables\n{\n}\n\n")
+    declaration_ids = [_identifiers(declaration) for declaration in declarations]
+    declaration_tokens = [count_tokens(declaration) + 1 for declaration in declarations]
+
+    def build_chunk(group: List[str], selected: Set[int]) -> str:
+        parts = [preamble] if preamble else []
+        if selected:
+            parts.append("variables\n{\n" + "\n".join(declarations[i] for i in sorted(selected)) + "\n}")
+        parts.extend(group)
+        return "\n\n".join(parts)
+
+    def header_tokens(selected: Set[int]) -> int:
+        return preamble_tokens + (wrapper_tokens + sum(declaration_tokens[i] for i in selected) if selected else 0)
+
+    chunks = []
+    group = []
+    group_tokens = 0
+    selected = set()
+    for unit in units:
+        unit_ids = _identifiers(unit)
+        unit_tokens = count_tokens(unit) + 2
+        # 已选中声明的间接引用已在之前处理，这里只需查找新函数引用的声明
+        candidate = _needed_declarations(unit_ids, declaration_ids, selected)
+        if group and header_tokens(candidate) + group_tokens + unit_tokens > budget:
+            chunks.append(build_chunk(group, selected))
+            group = []
+            group_tokens = 0
+            candidate = _needed_declarations(unit_ids, declaration_ids, set())
+        group.append(unit)
+        group_tokens += unit_tokens
+        selected = candidate
+        if len(group) == 1 and header_tokens(selected) + group_tokens > budget:
+            if header_tokens(selected) > budget:
+                print_colored(f"警告：预处理部分和函数用到的全局变量约{header_tokens(selected)} tokens，"
+                              f"已超出上下文预算（{budget} tokens）", COLOR_ERROR)
+            else:
+                print_colored(f"警告：单个函数约{unit_tokens} tokens，超出上下文预算（{budget} tokens），将单独发送", COLOR_ERROR)
+    if group:
+        chunks.append(build_chunk(group, selected))
+    return chunks
+
+class ConversionCancelled(Exception):
+    """转换过程中文件被再次修改，当前转换被取消"""
+
+class FileWatcher:
+    """文件变化监听器，优先使用inotify，不可用时退回到轮询"""
+    def __init__(self, paths: List[str]):
+        self.paths = []
+        for path in paths:
+            if os.path.isdir(path):
+                self.paths.append(os.path.abspath(path))
+            else:
+                print_colored(f"警告：目录不存在，不会监听其中的变化: {path}", COLOR_ERROR)
+        self.inotify = None
+        self.watch_dirs = {}
+        self.snapshot = {}
+        if INotify is not None:
+            try:
+                self.inotify = INotify()
+                for path in self.paths:
+                    self._add_watch_tree(path)
+            except (OSError, AttributeError) as e:
+                # 例如超出max_user_watches（ENOSPC），或系统C库中没有inotify函数，关闭已打开的inotify后改用轮询
+                print_colored(f"inotify不可用，改用轮询: {e}", COLOR_INFO)
+                if self.inotify is not None:
+                    self.inotify.close()
+                self.inotify = None
+                self.watch_dirs = {}
+        if self.inotify is None:
+            self.snapshot = self._take_snapshot()
+
+    def _add_watch_tree(self, path: str) -> Set[str]:
+        """递归监听目录，返回目录中已有的文件"""
+        mask = (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.MOVED_FROM
+                | inotify_flags.CREATE | inotify_flags.DELETE)
+        existing = set()
+        for root, _, files in os.walk(path):
+            wd = self.inotify.add_watch(root, mask)
+            self.watch_dirs[wd] = root
+            existing.update(os.path.join(root, file) for file in files)
+        return existing
+
+    def _take_snapshot(self) -> Dict[str, Tuple[float, int]]:
+        """记录所有文件的修改时间和大小"""
+        snapshot = {}
+        for path in self.paths:
+            for root, _, files in os.walk(path):
+                for file in files:
+                    file_path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError:
+                        continue
+                    snapshot[file_path] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout: float) -> Set[str]:
+        """等待文件变化，返回超时前发生变化的文件路径"""
+        if self.inotify is not None:
+            changed = set()
+            for event in self.inotify.read(timeout=int(timeout * 1000)):
+                if event.mask & inotify_flags.IGNORED:
+                    self.watch_dirs.pop(event.wd, None)
+                    continue
+                root = self.watch_dirs.get(event.wd)
+                if root is None or not event.name:
+                    continue
+                path = os.path.join(root, event.name)
+                if event.mask & inotify_flags.ISDIR:
+                    if event.mask & (inotify_flags.CREATE | inotify_flags.MOVED_TO):
+                        changed.update(self._add_watch_tree(path))
+                else:
+                    changed.add(path)
+            return changed
+
+        deadline = time.monotonic() + timeout
+        while True:
+            snapshot = self._take_snapshot()
+            changed = {path for path in snapshot.keys() | self.snapshot.keys()
+                       if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(WATCH_CONFIG["poll_interval"], remaining))
+
+    def close(self) -> None:
+        """停止监听"""
+        if self.inotify is not None:
+            self.inotify.close()
+
+def parse_capl_includes(file_path: str) -> Set[str]:
+    """解析CAPL文件中#include引用的文件，路径相对于当前文件所在目录"""
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            content = f.read()
+    except OSError:
+        return set()
+    base_dir = os.path.dirname(file_path)
+    return {os.path.normpath(os.path.join(base_dir, include.replace("\\", "/")))
+            for include in re.findall(r'#include\s+"([^"]+)"', content)}
+
+def find_include_dependents(changed: str, include_graph: Dict[str, Set[str]]) -> Set[str]:
+    """查找直接或间接引用了指定文件的所有文件（包括文件本身）"""
+    affected = {changed}
+    frontier = [changed]
+    while frontier:
+        target = frontier.pop()
+        for path, includes in include_graph.items():
+            if target in includes and path not in affected:
+                affected.add(path)
+                frontier.append(path)
+    return affected
+
+def mentions_rule(rule_name: str, text: str) -> bool:
+    """判断文本中是否以完整标识符的形式出现了规则名称（规则名称即规则文件名）"""
+    return re.search(rf"(?<!\w){re.escape(rule_name)}(?!\w)", text) is not None
+
+def find_rule_users(rule_path: str, mapping_dir: str, capl_files: List[str]) -> Set[str]:
+    """查找用到指定规则文件的CAPL文件：映射规则按规则名称匹配，VBA规则先找到引用它的映射规则再匹配"""
+    rule_name = os.path.splitext(os.path.basename(rule_path))[0]
+    if rule_path.startswith(mapping_dir + os.sep):
+        capl_rules = {rule_name}
+    else:
+        capl_rules = set()
+        try:
+            filenames = os.listdir(mapping_dir)
+        except OSError:
+            filenames = []
+        for filename in filenames:
+            if not filename.endswith(".txt"):
+                continue
+            try:
+                with open(os.path.join(mapping_dir, filename), "r") as f:
+                    if mentions_rule(rule_name, f.read()):
+                        capl_rules.add(filename.replace(".txt", ""))
+            except OSError:
+                continue
+    
+    users = set()
+    for file_path in capl_files:
+        try:
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                content = f.read()
+        except OSError:
+            continue
+        if any(mentions_rule(name, content) for name in capl_rules):
+            users.add(file_path)
+    return users
+
 class RuleLoader:
     """规则加载器类"""
+    MAPPING_DIR = "/Users/cuisijia/source/rule-reflection/output/reflection"
+    VBA_RULES_DIR = "/Users/cuisijia/source/rules/output/vba-rules-txt"
+
     def __init__(self):
         self.capl_to_vba_map = {}
         self.vba_rule_map = {}
@@ -73,7 +461,7 @@ class RuleLoader:
         
     def _load_capl_to_vba_mapping(self):
         """加载CAPL到VBA的映射规则"""
-        mapping_dir = "/Users/cuisijia/source/rule-reflection/output/reflection"
+        mapping_dir = self.MAPPING_DIR
         for filename in os.listdir(mapping_dir):
             if filename.endswith(".txt"):
                 with open(os.path.join(mapping_dir, filename), "r") as f:
@@ -84,7 +472,7 @@ class RuleLoader:
                     
     def _load_vba_rules(self):
         """加载VBA规则"""
-        vba_rules_dir = "/Users/cuisijia/source/rules/output/vba-rules-txt"
+        vba_rules_dir = self.VBA_RULES_DIR
         for filename in os.listdir(vba_rules_dir):
             if filename.endswith(".txt"):
                 with open(os.path.join(vba_rules_dir, filename), "r") as f:
@@ -100,6 +488,13 @@ class RuleLoader:
         """获取VBA规则的详细说明"""
         return self.vba_rule_map.get(vba_rule)
 
+    def find_relevant_rules(self, capl_code: str) -> Dict[str, Dict[str, str]]:
+        """查找代码中用到的CAPL映射规则，以及这些映射规则引用的VBA规则"""
+        capl_rules = {name: content for name, content in self.capl_to_vba_map.items() if mentions_rule(name, capl_code)}
+        mapped_text = "\n".join(capl_rules.values())
+        vba_rules = {name: content for name, content in self.vba_rule_map.items() if mentions_rule(name, mapped_text)}
+        return {"capl_to_vba_map": capl_rules, "vba_rule_map": vba_rules}
+
 class CodeAnalyzerAgent(AssistantAgent):
     def __init__(self):
         super().__init__(
@@ -395,9 +790,6 @@ class CodeIntegratorAgent(AssistantAgent):
 class CodeConverter:
     """代码转换器类"""
     def __init__(self):
-        self.rule_loader = RuleLoader()
-        self.rule_loader.load_rules()
-        
         # 初始化各个代理
         self.code_analyzer = CodeAnalyzerAgent()
         self.importer = ImportConverterAgent()
@@ -406,9 +798,12 @@ class CodeConverter:
         self.integrator = CodeIntegratorAgent()
         self.syntax_checker = PythonSyntaxCheckerAgent()
         
-        # 将规则添加到每个agent的system_message中
-        for agent in [self.converter]:
-            agent.update_system_message(agent.system_message + f"\n\n可用规则：\n{str(self.rule_loader.__dict__)}")
+        # 规则不再整体放入system_message，转换时只随请求发送代码中用到的规则
+        self.load_rules()
+        self.budget_warned = set()
+        
+        # 监听模式下用于取消正在进行的转换
+        self.should_cancel: Optional[Callable[[], bool]] = None
             
         self.user_proxy = UserProxyAgent(
             name="user_proxy",
@@ -441,6 +836,28 @@ class CodeConverter:
             llm_config=OPENAI_CONFIG
         )
 
+    def load_rules(self) -> None:
+        """加载规则，规则文件变化时可重复调用"""
+        self.rule_loader = RuleLoader()
+        self.rule_loader.load_rules()
+
+    def _rules_message(self, capl_code: str, log: bool = False) -> str:
+        """构造代码中用到的规则说明，附加在发送给converter的消息前；log为True时打印匹配到的规则名称"""
+        rules = self.rule_loader.find_relevant_rules(capl_code)
+        if log:
+            capl_names = ", ".join(rules["capl_to_vba_map"]) or "无"
+            vba_names = ", ".join(rules["vba_rule_map"]) or "无"
+            if rules["capl_to_vba_map"]:
+                print_colored(f"随请求发送的规则：CAPL映射规则 {capl_names}；VBA规则 {vba_names}", COLOR_INFO)
+            else:
+                print_colored("警告：代码中未匹配到任何规则名称（规则文件名），本次转换不带规则", COLOR_ERROR)
+        return f"可用规则：\n{str(rules)}\n\n"
+
+    def _check_cancelled(self) -> None:
+        """如果当前转换已被更新的修改取代，则中止转换"""
+        if self.should_cancel is not None and self.should_cancel():
+            raise ConversionCancelled()
+
     def read_capl_file(self, file_path: str) -> str:
         """读取CAPL文件内容"""
         try:
@@ -461,7 +878,7 @@ class CodeConverter:
             with open(output_path, 'w', encoding='utf-8') as f:
                 f.write(content)
             return True
-            except Exception as e:
+        except Exception as e:
             print(f"保存Python-VBA文件失败: {e}")
             return False
 
@@ -478,32 +895,332 @@ class CodeConverter:
         for root, _, files in os.walk(input_dir):
             for file in files:
                 if file.lower().endswith('.can'):  # 支持大小写的CAN文件扩展名
-                    # 构建输入和输出文件路径
-                    input_file = os.path.join(root, file)
-                    relative_path = os.path.relpath(input_file, input_dir)
-                    output_file = os.path.join(output_dir, os.path.splitext(relative_path)[0] + '.py')
-                    
-                    print(f"\n处理文件: {input_file}")
-                    print(f"输出文件: {output_file}")
-                    
-                    # 读取CAPL文件
-                    capl_code = self.read_capl_file(input_file)
-                    if not capl_code:
-                        print(f"跳过文件 {input_file} - 读取失败")
-                        continue
-                        
-                    # 转换代码
-                    print("开始转换代码...")
-                    python_vba_code = self.convert_code(capl_code)
-                    
-                    # 保存转换后的代码
-                    if self.save_python_vba_file(python_vba_code, output_file):
-                        print(f"成功保存转换后的代码到: {output_file}")
-                    else:
-                        print(f"保存转换后的代码失败: {output_file}")
+                    self.convert_file(os.path.join(root, file), input_dir, output_dir)
+
+    def convert_file(self, input_file: str, input_dir: str, output_dir: str) -> None:
+        """转换单个CAPL文件，输出路径保持与输入目录相同的相对结构"""
+        relative_path = os.path.relpath(input_file, input_dir)
+        output_file = os.path.join(output_dir, os.path.splitext(relative_path)[0] + '.py')
+        
+        print(f"\n处理文件: {input_file}")
+        print(f"输出文件: {output_file}")
+        
+        # 读取CAPL文件
+        capl_code = self.read_capl_file(input_file)
+        if not capl_code:
+            print(f"跳过文件 {input_file} - 读取失败")
+            return
+            
+        # 转换代码
+        print("开始转换代码...")
+        python_vba_code = self.convert_code(capl_code)
+        
+        # 转换期间文件已被再次修改时，不写入过期的结果
+        self._check_cancelled()
+        
+        # 保存转换后的代码
+        if self.save_python_vba_file(python_vba_code, output_file):
+            print(f"成功保存转换后的代码到: {output_file}")
+        else:
+            print(f"保存转换后的代码失败: {output_file}")
+
+    def _watch_worker(self, jobs: "queue.Queue", generations: Dict[str, int], input_dir: str, output_dir: str) -> None:
+        """监听模式的转换线程：依次执行任务，已被更新修改取代的任务直接跳过或中途取消"""
+        while True:
+            kind, path, generation = jobs.get()
+            if kind == "reload_rules":
+                print_colored("规则文件已变化，重新加载规则...", COLOR_SYSTEM)
+                try:
+                    self.load_rules()
+                except Exception as e:
+                    print_colored(f"重新加载规则失败: {e}", COLOR_ERROR)
+                continue
+            if generations.get(path) != generation or not os.path.exists(path):
+                continue
+            self.should_cancel = lambda path=path, generation=generation: generations.get(path) != generation
+            start = time.monotonic()
+            try:
+                self.convert_file(path, input_dir, output_dir)
+                print_colored(f"转换完成，耗时 {time.monotonic() - start:.1f} 秒: {path}", COLOR_INFO)
+            except ConversionCancelled:
+                print_colored(f"文件已再次修改，取消本次转换: {path}", COLOR_INFO)
+            except Exception as e:
+                print_colored(f"转换文件失败 {path}: {e}", COLOR_ERROR)
+            finally:
+                self.should_cancel = None
+
+    def watch_directory(self, input_dir: str, output_dir: str) -> None:
+        """监听CAPL目录和规则目录，文件保存后只重新转换受影响的文件及其引用方"""
+        input_dir = os.path.abspath(input_dir)
+        rule_dirs = [os.path.abspath(RuleLoader.MAPPING_DIR), os.path.abspath(RuleLoader.VBA_RULES_DIR)]
+        watcher = FileWatcher([input_dir] + rule_dirs)
+        print_colored(f"开始监听目录: {input_dir}（{'inotify' if watcher.inotify is not None else '轮询'}）", COLOR_SYSTEM)
+        
+        # 记录每个CAPL文件的#include引用关系
+        include_graph = {}
+        for root, _, files in os.walk(input_dir):
+            for file in files:
+                if file.lower().endswith(('.can', '.cin')):
+                    file_path = os.path.join(root, file)
+                    include_graph[file_path] = parse_capl_includes(file_path)
+        
+        # 每次修改都会递增文件的版本号，转换线程据此取消过期的转换
+        generations = {}
+        jobs = queue.Queue()
+        threading.Thread(target=self._watch_worker, args=(jobs, generations, input_dir, output_dir), daemon=True).start()
         
+        pending = set()
+        reload_rules = False
+        last_event = time.monotonic()
+        try:
+            while True:
+                changed = watcher.wait(WATCH_CONFIG["debounce_seconds"])
+                affected = set()
+                for path in changed:
+                    if any(path.startswith(rule_dir + os.sep) for rule_dir in rule_dirs):
+                        if path.endswith(".txt"):
+                            reload_rules = True
+                            # 只重新转换用到该规则的文件及其引用方
+                            users = find_rule_users(path, rule_dirs[0], list(include_graph))
+                            print_colored(f"规则文件已变化: {path}，{len(users)}个CAPL文件用到该规则", COLOR_INFO)
+                            for user in users:
+                                affected.update(find_include_dependents(user, include_graph))
+                    elif path.lower().endswith(('.can', '.cin')):
+                        if os.path.exists(path):
+                            include_graph[path] = parse_capl_includes(path)
+                        affected.update(find_include_dependents(path, include_graph))
+                        include_graph = {p: includes for p, includes in include_graph.items() if os.path.exists(p)}
+                
+                affected = {path for path in affected if path.lower().endswith('.can')}
+                if affected or (changed and reload_rules):
+                    for path in affected:
+                        generations[path] = generations.get(path, 0) + 1
+                    pending.update(affected)
+                    last_event = time.monotonic()
+                    continue
+                
+                # 静默时间内没有新的修改，提交合并后的转换任务
+                if (pending or reload_rules) and time.monotonic() - last_event >= WATCH_CONFIG["debounce_seconds"]:
+                    if reload_rules:
+                        jobs.put(("reload_rules", None, None))
+                        reload_rules = False
+                    for path in sorted(pending):
+                        jobs.put(("convert", path, generations[path]))
+                    pending.clear()
+        except KeyboardInterrupt:
+            print_colored("\n停止监听", COLOR_SYSTEM)
+        finally:
+            watcher.close()
+        
+    def _reply_reserved(self, agent: AssistantAgent) -> bool:
+        """analyzer复制代码、converter和integrator输出完整代码，回复与输入大小相当，需要为回复预留空间"""
+        return agent in (self.code_analyzer, self.converter, self.integrator)
+
+    def _available_tokens(self, agent: AssistantAgent) -> int:
+        """计算发送给指定agent的消息内容可用的token预算，需要时扣除为回复预留的空间"""
+        available = CONTEXT_CONFIG["max_request_tokens"] - count_tokens(agent.system_message)
+        if self._reply_reserved(agent):
+            available //= 2
+        if available < CONTEXT_CONFIG["min_content_tokens"] and agent.name not in self.budget_warned:
+            self.budget_warned.add(agent.name)
+            print_colored(f"警告：{agent.name}的系统提示词约{count_tokens(agent.system_message)} tokens，"
+                          f"请求将超出预算（{CONTEXT_CONFIG['max_request_tokens']} tokens）", COLOR_ERROR)
+        return max(available, CONTEXT_CONFIG["min_content_tokens"])
+
+    def _request(self, agent: AssistantAgent, content: str) -> str:
+        """向agent发送一条独立消息（不带对话历史），请求超出token预算时给出警告"""
+        content_tokens = count_tokens(content)
+        request_tokens = count_tokens(agent.system_message) + content_tokens
+        if self._reply_reserved(agent):
+            request_tokens += content_tokens
+        if request_tokens > CONTEXT_CONFIG["max_request_tokens"]:
+            print_colored(f"警告：发送给{agent.name}的请求约{request_tokens} tokens（含预留回复），"
+                          f"超出预算（{CONTEXT_CONFIG['max_request_tokens']} tokens）", COLOR_ERROR)
+        return agent.generate_reply(messages=[{"role": "user", "content": content}], sender=self.user_proxy) or ""
+
+    def _integration_pieces(self) -> List[str]:
+        """整理待集成的代码片段（包括导入语句），超出预算时先分层合并"""
+        snippets = []
+        for snippet in self.converted_snippets:
+            # 未通过语法检查的片段以注释形式附带检查意见，由 integrator 在集成时一并修正
+            check = snippet.get("check", "")
+            if check and "SYNTAX_CORRECT" not in check:
+                notes = "\n".join(f"# {line}" for line in check.strip().splitlines())
+                snippets.append(f"{snippet['converted']}\n\n# 语法检查意见（集成时请一并修正）：\n{notes}")
+            else:
+                snippets.append(snippet["converted"])
+        if self.imports:
+            snippets.insert(0, self.imports.replace("IMPORTS_COMPLETE", "").strip())
+        return self._merge_snippets(snippets)
+
+    def _join_if_over_budget(self, pieces: List[str]) -> Optional[str]:
+        """分层合并后仍无法放入一次集成请求时直接在本地拼接，不发送超出预算的请求"""
+        if count_tokens("\n\n".join(pieces)) <= self._integration_budget():
+            return None
+        print_colored(f"警告：集成内容无法放入一次请求，直接拼接{len(pieces)}个部分", COLOR_ERROR)
+        return "\n\n".join(pieces)
+
+    def _failed_snippet(self, agent_name: str, snippet_id: str, original: str) -> str:
+        """生成处理失败片段的占位内容，原始代码逐行注释，保证输出文件仍是合法的Python代码"""
+        commented = "\n".join(f"# {line}" if line.strip() else "#" for line in original.splitlines())
+        return f"{FAILED_SNIPPET_MARK} {agent_name}未能处理以下片段（{snippet_id}），请手动处理\n{commented}"
+
+    def _run_batched_phase(self, agent: AssistantAgent, prompt: str, markers: Tuple[str, ...], inputs: Dict[str, str],
+                           with_rules: bool = False, fallbacks: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """按token预算打包代码片段，每批发送一次请求，缺失或未完成的片段单独重试，重试仍失败时保留带标记的原始内容"""
+        instructions = (f"{prompt}。以下共有多个代码片段，每个片段以\"<<<片段 编号>>>\"开始、以\"<<<结束 编号>>>\"结束。\n"
+                        "请分别处理每个片段，并按相同的格式和编号逐个输出每个片段的结果，每个片段的结果中保留各自的完成标记：\n\n")
+        budget = self._available_tokens(agent) - count_tokens(instructions)
+        items = [format_snippet_batch([(snippet_id, content)]) for snippet_id, content in inputs.items()]
+        ids_by_item = dict(zip(items, inputs.keys()))
+        # 按每个片段单独附带规则估算大小，合并发送时规则去重，实际请求不会更大
+        packed = items
+        if with_rules:
+            packed = [self._rules_message(item) + item for item in items]
+            ids_by_item = dict(zip(packed, inputs.keys()))
+
+        def completed(result: Optional[str]) -> bool:
+            return bool(result) and (not markers or any(marker in result for marker in markers))
+
+        results = {}
+        for group in pack_by_budget(packed, budget, max_items=CONTEXT_CONFIG["batch_max_snippets"]):
+            group_ids = [ids_by_item[item] for item in group]
+            if len(group) == 1:
+                continue
+            self._check_cancelled()
+            print_colored(f"{agent.name} 批量处理片段：{', '.join(group_ids)}", COLOR_SYSTEM)
+            batch = format_snippet_batch([(snippet_id, inputs[snippet_id]) for snippet_id in group_ids])
+            rules = self._rules_message(batch, log=True) if with_rules else ""
+            reply = self._request(agent, rules + instructions + batch)
+            parsed = parse_snippet_batch(reply)
+            for snippet_id in group_ids:
+                result = parsed.get(snippet_id)
+                if completed(result):
+                    results[snippet_id] = result
+
+        # 未成功的片段（包括单独成组的大片段）单独发送
+        for snippet_id, content in inputs.items():
+            if snippet_id in results:
+                continue
+            self._check_cancelled()
+            print_colored(f"{agent.name} 单独处理片段：{snippet_id}", COLOR_SYSTEM)
+            rules = self._rules_message(content, log=True) if with_rules else ""
+            result = self._request(agent, f"{rules}{prompt}：\n\n{content}")
+            if not completed(result):
+                print_colored(f"{agent.name} 处理片段{snippet_id}失败，保留原始内容", COLOR_ERROR)
+                original = fallbacks[snippet_id] if fallbacks else content
+                # 没有可保留的内容时（如语法检查意见）留空
+                result = self._failed_snippet(agent.name, snippet_id, original) if original else ""
+            results[snippet_id] = result
+        return results
+
+    def _process_snippets_batched(self, snippets: List[str]) -> List[Dict]:
+        """批量完成代码片段的语法识别、转换和语法检查"""
+        originals = {f"S{i}": snippet for i, snippet in enumerate(snippets, 1)}
+        recognized = self._run_batched_phase(
+            self.syntax_recognizer, "请识别以下CAPL代码中的语法", ("SYNTAX_RECOGNIZED",), originals)
+        converted = self._run_batched_phase(
+            self.converter, "请将以下CAPL代码转换为Python-VBA代码", ("VARIABLES_COMPLETE", "FUNCTIONS_COMPLETE"),
+            {snippet_id: f"{code}\n\n识别出的CAPL语法：\n{recognized[snippet_id]}" for snippet_id, code in originals.items()},
+            with_rules=True, fallbacks=originals)
+        # 转换失败的片段只有注释掉的原始代码，无需语法检查
+        to_check = {snippet_id: code for snippet_id, code in converted.items()
+                    if not code.startswith(FAILED_SNIPPET_MARK)}
+        checked = self._run_batched_phase(
+            self.syntax_checker, "请检查以下Python-VBA代码片段的语法", (), to_check,
+            fallbacks={snippet_id: "" for snippet_id in to_check})
+        return [{
+            "id": snippet_id,
+            "original": code,
+            "syntax": recognized[snippet_id],
+            "converted": converted[snippet_id],
+            "check": checked.get(snippet_id, "")
+        } for snippet_id, code in originals.items()]
+
+    def _integrate_group(self, snippets: List[str]) -> str:
+        """使用独立对话将一组代码片段集成为一个代码片段"""
+        self._check_cancelled()
+        integration_content = "\n\n".join(snippets)
+        reply = self._request(self.integrator, f"请将以下转换后的代码片段集成为完整的Python-VBA代码：\n\n{integration_content}")
+        if not reply:
+            print_colored("分组集成失败，保留原始代码片段", COLOR_ERROR)
+            return integration_content
+        merged = reply.rstrip()
+        if merged.endswith("TERMINATE"):
+            merged = merged[:-len("TERMINATE")].rstrip()
+        return merged
+
+    def _integration_budget(self) -> int:
+        """计算一次集成请求中代码片段可用的token预算"""
+        prompt_tokens = count_tokens("请将以下转换后的代码片段集成为完整的Python-VBA代码：\n\n")
+        return self._available_tokens(self.integrator) - prompt_tokens
+
+    def _merge_snippets(self, snippets: List[str]) -> List[str]:
+        """分层集成代码片段：逐轮按预算分组合并，直到全部片段可以放入一次集成请求"""
+        budget = self._integration_budget()
+        pieces = list(snippets)
+        level = 0
+        while len(pieces) > 1 and count_tokens("\n\n".join(pieces)) > budget:
+            groups = pack_by_budget(pieces, budget, max_items=CONTEXT_CONFIG["integration_group_size"])
+            if len(groups) == len(pieces):
+                print_colored("警告：代码片段无法在上下文预算内继续合并", COLOR_ERROR)
+                break
+            level += 1
+            print_colored(f"第{level}层集成：{len(pieces)}个片段合并为{len(groups)}组", COLOR_SYSTEM)
+            pieces = [self._integrate_group(group) if len(group) > 1 else group[0] for group in groups]
+        return pieces
+
     def convert_code(self, capl_code: str) -> str:
-        """转换CAPL代码为VBA代码"""
+        """转换CAPL代码为VBA代码，超出上下文预算时按函数分块转换后分层集成"""
+        budget = self._available_tokens(self.code_analyzer) - count_tokens("请将以下CAPL代码转换为VBA代码：\n\n")
+        if count_tokens(capl_code) <= budget:
+            return self._convert_single(capl_code)
+
+        # 每块的转换结果与输入大小相当，按集成分组大小切分，保证一次集成请求能合并一整组结果
+        budget = min(budget, self._integration_budget() // CONTEXT_CONFIG["integration_group_size"])
+        chunks = split_capl_code(capl_code, budget)
+        if len(chunks) <= 1:
+            return self._convert_single(capl_code)
+        print_colored(f"代码超出上下文预算（{budget} tokens），按函数边界分为{len(chunks)}块转换", COLOR_SYSTEM)
+
+        chunk_results = []
+        for i, chunk in enumerate(chunks, 1):
+            self._check_cancelled()
+            print_colored(f"\n开始转换第{i}/{len(chunks)}块...", COLOR_SYSTEM)
+            chunk_results.append(self._convert_single(chunk))
+
+        pieces = self._merge_snippets(chunk_results)
+        if len(pieces) == 1:
+            return pieces[0]
+        joined = self._join_if_over_budget(pieces)
+        if joined is not None:
+            return joined
+        return self._integrate_group(pieces)
+
+    def _next_snippet_phase(self) -> str:
+        """取出下一个待处理的代码片段并发送给 syntax_recognizer，全部处理完成后进入集成阶段（超出预算时直接拼接）"""
+        if self.processing_queue:
+            self.current_item = self.processing_queue.pop(0)
+            self.groupchat.messages.append({
+                "role": "user",
+                "content": f"请识别以下CAPL代码中的语法：\n\n{self.current_item}"
+            })
+            return "syntax_recognize"
+        # 所有代码片段处理完成，发送所有转换后的代码片段给 integrator
+        pieces = self._integration_pieces()
+        joined = self._join_if_over_budget(pieces)
+        if joined is not None:
+            self.converted_code = joined
+            return "complete"
+        integration_content = "\n\n".join(pieces)
+        self.groupchat.messages.append({
+            "role": "user",
+            "content": f"请将以下转换后的代码片段集成为完整的Python-VBA代码：\n\n{integration_content}"
+        })
+        return "integration"
+
+    def _convert_single(self, capl_code: str) -> str:
+        """在一次对话中转换单个CAPL代码块"""
         # 初始化对话
         self.groupchat.messages = []
         print_colored("开始转换代码...", COLOR_SYSTEM)
@@ -530,14 +1247,21 @@ class CodeConverter:
             "structs": []    # 存储结构体定义部分
         }
         
+        # 是否已批量处理代码片段
+        batched = False
+        
         # 存储当前正在处理的代码片段
         current_section = None
         current_section_type = None
         
-        # 存储转换后的代码片段
+        # 存储转换后的代码片段、导入语句和集成后的代码
         self.converted_snippets = []
+        self.processing_queue = []
+        self.imports = ""
+        self.converted_code = ""
         
-        while len(self.groupchat.messages) < self.groupchat.max_round:
+        while round_count < self.groupchat.max_round and current_phase != "complete":
+            self._check_cancelled()
             round_count += 1
             print_colored(f"\n第{round_count}轮对话开始...", COLOR_SYSTEM)
             
@@ -552,6 +1276,8 @@ class CodeConverter:
                 next_agent = self.converter
             elif current_phase == "functions":
                 next_agent = self.converter
+            elif current_phase == "convert":
+                next_agent = self.converter
             elif current_phase == "integration":
                 next_agent = self.integrator
             else:
@@ -559,18 +1285,15 @@ class CodeConverter:
                 
             print_colored(f"选择下一个发言者: {next_agent.name}", COLOR_SYSTEM)
             
-            # 生成回复
+            # 每个阶段只发送本阶段的请求，不携带完整的对话历史，保证每次请求都在token预算内
+            request = next(msg for msg in reversed(self.groupchat.messages) if msg["role"] == "user")
             print_colored("生成回复...", COLOR_SYSTEM)
             print_colored("\n发送给大模型的消息内容：", COLOR_SYSTEM)
             print_colored("="*50, COLOR_SYSTEM)
-            for msg in self.groupchat.messages:
-                print_message(msg)
+            print_message(request)
             print_colored("="*50, COLOR_SYSTEM)
             
-            reply = next_agent.generate_reply(
-                messages=self.groupchat.messages,
-                sender=self.user_proxy
-            )
+            reply = self._request(next_agent, request["content"])
             
             # 添加回复到消息历史
             if reply:
@@ -594,7 +1317,8 @@ class CodeConverter:
                     # 提取预处理部分
                     preprocess_pattern = r"```c\n预处理部分：\n(.*?)\n```"
                     preprocess_match = re.search(preprocess_pattern, reply, re.DOTALL)
-                    if preprocess_match:
+                    # 没有预处理指令时分析结果为“空”，不进入导入转换阶段
+                    if preprocess_match and preprocess_match.group(1).strip() not in ("空", "预处理部分：空"):
                         sections["preprocess"] = preprocess_match.group(1).strip()
                     
                     # 提取代码片段
@@ -611,74 +1335,79 @@ class CodeConverter:
                         print_colored(f"\n代码片段{i}：", COLOR_SYSTEM)
                         print_colored(snippet, COLOR_DEBUG)
                     
+                    # 批量模式：将小代码片段打包，每个阶段按批发送请求
+                    batched = CONTEXT_CONFIG["batch_snippets"] and bool(sections["code_snippets"])
+                    if batched:
+                        self.converted_snippets = self._process_snippets_batched(sections["code_snippets"])
+                    
+                    # 初始化处理队列
+                    self.processing_queue = [] if batched else sections["code_snippets"].copy()
+                    
                     # 进入下一阶段
                     if sections["preprocess"]:
                         current_phase = "imports"
                         current_section = sections["preprocess"]
                         current_section_type = "preprocess"
+                        # 发送给 importer
+                        self.groupchat.messages.append({
+                            "role": "user",
+                            "content": f"请将以下CAPL预处理指令转换为导入语句：\n\n{current_section}"
+                        })
                     else:
-                        # 初始化处理队列
-                        self.processing_queue = sections["code_snippets"].copy()
-                        
-                        if self.processing_queue:
-                            self.current_item = self.processing_queue.pop(0)
-                            current_phase = "syntax_recognize"
-                            # 发送给 syntax_recognizer
-                            self.groupchat.messages.append({
-                                "role": "user",
-                                "content": f"请识别以下CAPL代码中的语法：\n\n{self.current_item}"
-                            })
-                        else:
-                            # 如果没有需要处理的代码片段，直接进入集成阶段
-                            current_phase = "integration"
+                        current_phase = self._next_snippet_phase()
                 
                 # 处理导入转换结果
                 elif current_phase == "imports" and "IMPORTS_COMPLETE" in reply:
-                    current_phase = "syntax_recognize"
+                    self.imports = reply
+                    current_phase = self._next_snippet_phase()
                 
                 # 处理语法识别结果
                 elif current_phase == "syntax_recognize" and "SYNTAX_RECOGNIZED" in reply:
-                    # 存储当前代码片段的转换结果
+                    # 存储当前代码片段的语法识别结果
                     self.converted_snippets.append({
+                        "id": f"S{len(self.converted_snippets) + 1}",
                         "original": self.current_item,
-                        "converted": reply
+                        "syntax": reply
                     })
                     
-                    # 对当前转换后的代码片段进行语法检查
-                    current_phase = "syntax_check"
-                    # 只发送当前代码片段给 syntax_checker
-                    current_snippet = self.converted_snippets[-1]["converted"]
+                    # 将代码片段和识别出的语法连同相关规则发送给 converter
+                    current_phase = "convert"
                     self.groupchat.messages.append({
                         "role": "user",
-                        "content": f"请检查以下单个Python-VBA代码片段的语法：\n\n{current_snippet}"
+                        "content": (f"{self._rules_message(self.current_item, log=True)}"
+                                    f"请将以下CAPL代码转换为Python-VBA代码：\n\n{self.current_item}\n\n识别出的CAPL语法：\n{reply}")
                     })
                 
-                # 处理语法检查结果
-                elif current_phase == "syntax_check" and "SYNTAX_CHECK_COMPLETE" in reply:
-                    # 语法检查通过，处理下一个代码片段
-                    current_phase = "syntax_recognize"
-                    if self.processing_queue:
-                        self.current_item = self.processing_queue.pop(0)
-                        # 发送给 syntax_recognizer
+                # 处理代码转换结果
+                elif current_phase == "convert":
+                    current_snippet = self.converted_snippets[-1]
+                    if "VARIABLES_COMPLETE" in reply or "FUNCTIONS_COMPLETE" in reply:
+                        current_snippet["converted"] = reply
+                        # 对当前转换后的代码片段进行语法检查
+                        current_phase = "syntax_check"
+                        # 只发送当前代码片段给 syntax_checker
                         self.groupchat.messages.append({
                             "role": "user",
-                            "content": f"请识别以下CAPL代码中的语法：\n\n{self.current_item}"
+                            "content": f"请检查以下单个Python-VBA代码片段的语法：\n\n{reply}"
                         })
                     else:
-                        # 所有代码片段处理完成，进入集成阶段
-                        current_phase = "integration"
-                        # 发送所有转换后的代码片段给 integrator
-                        integration_content = "\n\n".join([snippet["converted"] for snippet in self.converted_snippets])
-                        self.groupchat.messages.append({
-                            "role": "user",
-                            "content": f"请将以下转换后的代码片段集成为完整的Python-VBA代码：\n\n{integration_content}"
-                        })
+                        # 转换失败的片段保留注释掉的原始代码，不做语法检查
+                        print_colored(f"{self.converter.name} 处理片段{current_snippet['id']}失败，保留原始内容", COLOR_ERROR)
+                        current_snippet["converted"] = self._failed_snippet(
+                            self.converter.name, current_snippet["id"], current_snippet["original"])
+                        current_snippet["check"] = ""
+                        current_phase = self._next_snippet_phase()
+                
+                # 处理语法检查结果，检查意见随代码片段一起交给 integrator
+                elif current_phase == "syntax_check":
+                    self.converted_snippets[-1]["check"] = reply
+                    current_phase = self._next_snippet_phase()
                 
                 # 处理集成结果
-                elif current_phase == "integration" and "INTEGRATION_COMPLETE" in reply:
+                elif current_phase == "integration":
                     # 存储集成后的代码
-                    self.converted_code = reply
-                    current_phase = "syntax_check"
+                    self.converted_code = re.sub(r"\s*(INTEGRATION_COMPLETE|TERMINATE)\s*$", "", reply.rstrip())
+                    current_phase = "final_check"
                     # 发送给 syntax_checker
                     self.groupchat.messages.append({
                         "role": "user",
@@ -686,18 +1415,22 @@ class CodeConverter:
                     })
                 
                 # 处理最终语法检查结果
-                elif current_phase == "syntax_check" and "SYNTAX_CHECK_COMPLETE" in reply:
+                elif current_phase == "final_check":
                     # 语法检查完成，转换结束
                     current_phase = "complete"
                     break
         
-        # 如果循环结束还没有得到结果，返回最后一个消息
-        final_message = self.groupchat.messages[-1]["content"]
+        # 优先返回集成后的代码，如果循环结束还没有得到结果，返回最后一个消息
+        final_message = self.converted_code or self.groupchat.messages[-1]["content"]
         print_colored("\n转换完成！", COLOR_SYSTEM)
         print_colored("="*50, COLOR_SYSTEM)
         return final_message
         
-    if __name__ == "__main__":
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="将CAPL代码转换为Python-VBA代码")
+    parser.add_argument("--watch", action="store_true", help="监听文件变化，自动重新转换修改过的文件")
+    args = parser.parse_args()
+    
     # 设置输入和输出目录
     input_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "input")  # CAPL文件目录
     output_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "output")  # Python-VBA文件输出目录
@@ -705,7 +1438,11 @@ class CodeConverter:
     print("初始化代码转换器...")
     converter = CodeConverter()
     
-    # 处理整个目录
-    converter.process_directory(input_dir, output_dir)
-    
-    print("\n所有文件处理完成！") 
\ No newline at end of file
+    if args.watch:
+        # 监听模式：保持转换器常驻，只转换发生变化的文件
+        converter.watch_directory(input_dir, output_dir)
+    else:
+        # 处理整个目录
+        converter.process_directory(input_dir, output_dir)
+        
+        print("\n所有文件处理完成！") 